@@ -0,0 +1,414 @@
+"""
+Shared token measurement helpers for measure-context.py and compare-context.py.
+
+Counts are cached twice: in-process with functools.lru_cache, and across
+runs in .tiki/.token-cache.json. Both are keyed on each file's
+(st_mtime_ns, st_size), so edited files are always re-measured.
+
+When a measurement server (measure-context.py --server) is listening on
+.tiki/.measure.sock, counting is delegated to it so the encoder is only
+built once. The first run without a server starts one in the background.
+"""
+
+import tiktoken
+import functools
+import os
+import json
+import socket
+import socketserver
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+ENCODING_NAME = 'cl100k_base'
+
+@functools.lru_cache(maxsize=None)
+def load_encoding():
+    """Load cl100k_base, using the faster TokenDagger backend when installed."""
+    base = tiktoken.get_encoding(ENCODING_NAME)
+    try:
+        import tokendagger
+    except ImportError:
+        return base
+
+    # TokenDagger is API-compatible but ships no rank tables, so build it
+    # from the ones tiktoken already loaded.
+    try:
+        fast = tokendagger.Encoding(
+            name=base.name,
+            pat_str=base._pat_str,
+            mergeable_ranks=base._mergeable_ranks,
+            special_tokens=base._special_tokens,
+        )
+    except (AttributeError, TypeError) as e:
+        print(f'WARNING: TokenDagger unusable ({e}), using tiktoken', file=sys.stderr)
+        return base
+    if not hasattr(fast, 'encode_ordinary_batch'):
+        print('WARNING: TokenDagger has no encode_ordinary_batch, using tiktoken', file=sys.stderr)
+        return base
+    return fast
+
+CACHE_PATH = '.tiki/.token-cache.json'
+# Bump when reading, newline handling or line/token counting rules change
+CACHE_VERSION = 1
+SOCKET_PATH = '.tiki/.measure.sock'
+PROFILE_PATH = '.tiki/.measure.prof'
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'measure-context.py')
+SERVER_IDLE_TIMEOUT = 600  # seconds
+SERVER_REPLY_TIMEOUT = 10  # seconds; count locally if the server is slower
+# First line each way; a server started from other code refuses and exits
+SERVER_HELLO = f'HELLO v{CACHE_VERSION} {ENCODING_NAME}'
+
+def load_cache():
+    """Load cached token counts, keyed by path; empty if written under other rules."""
+    try:
+        with open(CACHE_PATH, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if (not isinstance(cache, dict)
+            or cache.get('version') != CACHE_VERSION
+            or cache.get('encoding') != ENCODING_NAME):
+        return {}
+    return cache.get('files', {})
+
+_CACHE = load_cache()
+_dirty_paths = set()
+
+def save_cache():
+    """Merge changed entries into the on-disk token cache."""
+    if not _dirty_paths:
+        return
+    # Another process (e.g. the server) may have written since we loaded
+    cache = load_cache()
+    cache.update((path, _CACHE[path]) for path in _dirty_paths)
+    tmp_path = f'{CACHE_PATH}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': CACHE_VERSION, 'encoding': ENCODING_NAME, 'files': cache}, f)
+        os.replace(tmp_path, CACHE_PATH)
+    except OSError:
+        return
+    _dirty_paths.clear()
+
+COMMANDS_DIR = '.claude/commands/tiki'
+
+# The commands the context refactoring targets; measure-context's totals
+# cover only these so they stay comparable with earlier baselines
+LARGE_COMMANDS = [
+    'execute.md',
+    'plan-issue.md',
+    'define-requirements.md',
+    'research.md',
+    'debug.md',
+    'release-yolo.md',
+]
+
+PROMPT_DIRS = [
+    '.tiki/prompts/execute',
+    '.tiki/prompts/plan',
+    '.tiki/prompts/requirements',
+    '.tiki/prompts/research',
+    '.tiki/prompts/debug',
+    '.tiki/prompts/release',
+]
+
+def read_bytes(filepath):
+    """Read a file as bytes with newlines normalised, or None if missing or empty."""
+    try:
+        if os.stat(filepath).st_size == 0:
+            return None
+        with open(filepath, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    # Match text-mode universal newlines so counts stay comparable
+    if b'\r' in data:
+        data = data.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+    return data
+
+def read_file(filepath):
+    """Read a file, returning its content and line count."""
+    data = read_bytes(filepath)
+    if data is None:
+        return '', 0
+    lines = data.count(b'\n') + 1
+    try:
+        return data.decode('utf-8'), lines
+    except UnicodeDecodeError as e:
+        # Like encode_batch, zero only this file's tokens rather than the run
+        print(f'WARNING: {filepath} is not valid UTF-8 ({e}), counting 0 tokens', file=sys.stderr)
+        return '', lines
+
+@functools.lru_cache(maxsize=None)
+def gather_commands():
+    """Collect (name, path) for every command in COMMANDS_DIR, sorted by name."""
+    try:
+        it = os.scandir(COMMANDS_DIR)
+    except FileNotFoundError:
+        return ()
+    with it:
+        commands = [
+            (entry.name, entry.path) for entry in it
+            if entry.name.endswith('.md') and entry.is_file()
+        ]
+    return tuple(sorted(commands))
+
+def gather_files(extra_paths=()):
+    """Collect the path of every command, extra file and prompt file to measure."""
+    return [path for _, path in gather_commands()] + list(extra_paths) + gather_prompt_files()
+
+def gather_prompt_files():
+    """Collect the path of every extracted prompt file."""
+    paths = []
+    for dir_path in PROMPT_DIRS:
+        try:
+            it = os.scandir(dir_path)
+        except FileNotFoundError:
+            continue
+        with it:
+            for entry in it:
+                if entry.name.endswith('.md') and entry.is_file():
+                    paths.append(entry.path)
+
+    return paths
+
+def file_stamp(filepath):
+    """Return (mtime_ns, size) identifying the current version of a file."""
+    try:
+        st = os.stat(filepath)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+def count_tokens(paths, use_server=True):
+    """Count tokens and lines for all files, as {path: (tokens, lines)}."""
+    counts = query_server(paths) if use_server else None
+    if counts is None:
+        counts = count_tokens_local(paths)
+        save_cache()
+    return counts
+
+def count_tokens_local(paths):
+    """Count tokens and lines in this process, without asking the server."""
+    return dict(_count_stamped(tuple((path, file_stamp(path)) for path in paths)))
+
+def count_tokens_worker(paths):
+    """count_tokens_local() for a pool worker; also returns its new cache entries.
+
+    Workers never write the cache file themselves: the parent merges every
+    worker's entries with merge_cache() and saves once.
+    """
+    counts = count_tokens_local(paths)
+    return counts, {path: _CACHE[path] for path in _dirty_paths}
+
+def merge_cache(entries):
+    """Adopt cache entries computed in another process."""
+    _CACHE.update(entries)
+    _dirty_paths.update(entries)
+
+@functools.lru_cache(maxsize=None)
+def _count_stamped(stamped):
+    """Count (path, stamp) pairs, batch-encoding only on-disk cache misses."""
+    counts = {}
+    misses = []
+    for path, stamp in stamped:
+        cached = _CACHE.get(path)
+        if not stamp or not stamp[1]:
+            # Missing or empty; nothing to read or encode
+            counts[path] = (0, 0)
+        elif cached and tuple(cached['stamp']) == stamp:
+            counts[path] = (cached['tokens'], cached['lines'])
+        else:
+            counts[path] = None
+            misses.append((path, stamp))
+
+    if misses:
+        # Reads release the GIL, so fetch all uncached files concurrently
+        with ThreadPoolExecutor(max_workers=min(32, len(misses))) as executor:
+            files = list(executor.map(read_file, [path for path, _ in misses]))
+
+        texts = [content for content, _ in files]
+        encoded = encode_batch(texts)
+        for (path, stamp), (_, lines), tokens in zip(misses, files, encoded):
+            counts[path] = (len(tokens), lines)
+            _CACHE[path] = {'stamp': stamp, 'tokens': len(tokens), 'lines': lines}
+            _dirty_paths.add(path)
+
+    return tuple(counts.items())
+
+def encode_batch(texts):
+    """Encode texts in one batch, zeroing only the texts the encoder rejects."""
+    enc = load_encoding()
+    try:
+        return enc.encode_ordinary_batch(texts, num_threads=os.cpu_count() or 1)
+    except ValueError:
+        pass
+
+    # One bad file must not zero the whole run, so retry file by file
+    encoded = []
+    for text in texts:
+        try:
+            encoded.append(enc.encode_ordinary(text))
+        except ValueError:
+            encoded.append([])
+    return encoded
+
+def count_lines_only(paths):
+    """Count lines without tokenizing, as {path: (0, lines)}."""
+    counts = {}
+    for path in paths:
+        data = read_bytes(path)
+        counts[path] = (0, data.count(b'\n') + 1 if data is not None else 0)
+    return counts
+
+def query_server(paths):
+    """Ask a running measurement server for counts; None if none is available."""
+    if not hasattr(socket, 'AF_UNIX'):
+        return None
+
+    request = (SERVER_HELLO + '\n' + ''.join(f'MEASURE {path}\n' for path in paths)).encode('utf-8')
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(SERVER_REPLY_TIMEOUT)
+            sock.connect(SOCKET_PATH)
+            sock.sendall(request)
+            sock.shutdown(socket.SHUT_WR)
+            with sock.makefile('rb') as f:
+                data = f.read()
+    except (FileNotFoundError, ConnectionRefusedError):
+        _spawn_server()
+        return None
+    except socket.timeout:
+        return None  # wedged or overloaded server
+    except OSError:
+        return None
+
+    try:
+        replies = data.decode('utf-8').splitlines()
+        if replies[:1] != [SERVER_HELLO] or len(replies) != len(paths) + 1:
+            return None  # stale server or a short reply
+        counts = {}
+        for path, reply in zip(paths, replies[1:]):
+            tokens, lines = reply.split()
+            counts[path] = (int(tokens), int(lines))
+    except ValueError:
+        return None  # malformed reply
+    return counts
+
+def _server_alive():
+    """Whether a measurement server is accepting connections on SOCKET_PATH."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(SOCKET_PATH)
+        except OSError:
+            return False
+    return True
+
+def _spawn_server():
+    """Start a measurement server in the background for later runs."""
+    try:
+        subprocess.Popen(
+            [sys.executable, SERVER_SCRIPT, '--server'],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+    except OSError:
+        pass
+
+if hasattr(socketserver, 'UnixStreamServer'):
+    class _MeasureHandler(socketserver.StreamRequestHandler):
+        """Answer SERVER_HELLO, then each `MEASURE <path>` line with `<tokens> <lines>`."""
+
+        def handle(self):
+            lines = (line.decode('utf-8').rstrip('\n') for line in self.rfile)
+            hello = next(lines, None)
+            if hello is None:
+                return  # liveness probe from another server
+            if hello != SERVER_HELLO:
+                # The client runs different code; stop rather than serve stale counts
+                self.server.stale = True
+                return
+
+            paths = []
+            for line in lines:
+                command, _, path = line.partition(' ')
+                if command == 'MEASURE':
+                    paths.append(path)
+
+            counts = count_tokens_local(paths)
+            self.wfile.write((SERVER_HELLO + '\n' + ''.join(
+                '%d %d\n' % counts[path] for path in paths
+            )).encode('utf-8'))
+            save_cache()
+
+    class _MeasureServer(socketserver.UnixStreamServer):
+        timeout = SERVER_IDLE_TIMEOUT
+        idle = False
+        stale = False
+
+        def handle_timeout(self):
+            self.idle = True
+
+def serve():
+    """Serve token counts on SOCKET_PATH until idle for SERVER_IDLE_TIMEOUT.
+
+    Exits early when a client speaks a different SERVER_HELLO, so the next
+    run starts a server from the current code.
+    """
+    if not hasattr(socketserver, 'UnixStreamServer'):
+        sys.exit('ERROR: --server needs Unix domain socket support')
+
+    load_encoding()
+    try:
+        server = _MeasureServer(SOCKET_PATH, _MeasureHandler)
+    except OSError:
+        # Socket already exists: leave a live server alone, replace a stale one
+        if _server_alive():
+            return
+        os.unlink(SOCKET_PATH)
+        server = _MeasureServer(SOCKET_PATH, _MeasureHandler)
+
+    try:
+        while not (server.idle or server.stale):
+            server.handle_request()
+    finally:
+        server.server_close()
+        os.unlink(SOCKET_PATH)
+
+def profile(func):
+    """Run func() under cProfile and dump the stats to PROFILE_PATH."""
+    import cProfile
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        func()
+    finally:
+        profiler.disable()
+        profiler.dump_stats(PROFILE_PATH)
+        print(f'Profile written to {PROFILE_PATH}', file=sys.stderr)
+
+def measure_commands(counts):
+    """Measure all commands, as {name: {'path', 'tokens', 'lines'}}."""
+    results = {}
+    for name, path in gather_commands():
+        tokens, lines = counts[path]
+        results[name] = {'path': path, 'tokens': tokens, 'lines': lines}
+
+    return results
+
+def measure_prompt_files(counts):
+    """Measure extracted prompt files, as {dir_path: {filename: {'tokens', 'lines'}}}."""
+    results = {}
+    for path, (tokens, lines) in counts.items():
+        dir_path, filename = os.path.split(path)
+        if dir_path in PROMPT_DIRS:
+            results.setdefault(dir_path, {})[filename] = {
+                'tokens': tokens,
+                'lines': lines
+            }
+
+    return results
@@ -4,96 +4,94 @@ Compare context window usage before and after refactoring.
 
 Usage:
     python .tiki/scripts/compare-context.py
+    python .tiki/scripts/compare-context.py --lines-only  # Compare line counts, no tokenizing
+    python .tiki/scripts/compare-context.py --profile  # Write cProfile stats to .tiki/.measure.prof
+
+View a profile with: snakeviz .tiki/.measure.prof
 
 Requires .tiki/context-baseline.json to exist (from measure-context.py --json)
 """
 
-import tiktoken
+import argparse
+import contextlib
+import io
 import os
 import json
+import multiprocessing
+import sys
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 
-enc = tiktoken.get_encoding('cl100k_base')
+import _measure_lib
+from _measure_lib import count_lines_only, count_tokens, gather_prompt_files
 
-def count_tokens(filepath):
-    """Count tokens and lines in a file."""
-    try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            content = f.read()
-        return len(enc.encode(content)), len(content.split('\n'))
-    except:
-        return 0, 0
+# Per-row report templates, selected once per table rather than per row
+ROW_FMT = '{name:<25} {base:>12,} {curr:>12,} {change:>+12,} {pct:>+11.1f}% {ind}'
+NEW_ROW_FMT = '{name:<25} {curr:>12,}'
+PROMPT_ROW_FMT = '  {path:<50} {lines:>6} lines  {tokens:>8,} tokens'
+PROMPT_LINES_ROW_FMT = '  {path:<50} {lines:>6} lines'
 
 def load_baseline():
     """Load baseline measurements."""
     try:
-        with open('.tiki/context-baseline.json', 'r') as f:
+        with open('.tiki/context-baseline.json', 'r', encoding='utf-8') as f:
             return json.load(f)
     except FileNotFoundError:
         print("ERROR: No baseline found. Run first:")
         print("  python .tiki/scripts/measure-context.py --json > .tiki/context-baseline.json")
         return None
 
-def measure_current():
+def measure_current(counts):
     """Measure current state."""
-    commands = [
-        ('execute.md', '.claude/commands/tiki/execute.md'),
-        ('plan-issue.md', '.claude/commands/tiki/plan-issue.md'),
-        ('define-requirements.md', '.claude/commands/tiki/define-requirements.md'),
-        ('research.md', '.claude/commands/tiki/research.md'),
-        ('debug.md', '.claude/commands/tiki/debug.md'),
-        ('release-yolo.md', '.claude/commands/tiki/release-yolo.md'),
-    ]
-
-    results = {}
-    for name, path in commands:
-        tokens, lines = count_tokens(path)
-        results[name] = {'tokens': tokens, 'lines': lines}
-
-    return results
-
-def measure_prompt_files():
-    """Measure extracted prompt files."""
-    prompt_dirs = [
-        '.tiki/prompts/execute',
-        '.tiki/prompts/plan',
-        '.tiki/prompts/requirements',
-        '.tiki/prompts/research',
-        '.tiki/prompts/debug',
-        '.tiki/prompts/release',
-    ]
-
-    total_tokens = 0
-    total_lines = 0
-    files = []
-
-    for dir_path in prompt_dirs:
-        if os.path.exists(dir_path):
-            for filename in os.listdir(dir_path):
-                if filename.endswith('.md'):
-                    filepath = os.path.join(dir_path, filename)
-                    tokens, lines = count_tokens(filepath)
-                    total_tokens += tokens
-                    total_lines += lines
-                    files.append({
-                        'path': os.path.join(dir_path, filename),
-                        'tokens': tokens,
-                        'lines': lines
-                    })
+    return _measure_lib.measure_commands(counts)
+
+def measure_prompt_files(counts):
+    """Measure extracted prompt files, as parallel paths/tokens/lines lists."""
+    paths = []
+    tokens = []
+    lines = []
+
+    for dir_path, dir_files in _measure_lib.measure_prompt_files(counts).items():
+        for filename, info in dir_files.items():
+            paths.append(os.path.join(dir_path, filename))
+            tokens.append(info['tokens'])
+            lines.append(info['lines'])
 
     return {
-        'total_tokens': total_tokens,
-        'total_lines': total_lines,
-        'files': files
+        'total_tokens': sum(tokens),
+        'total_lines': sum(lines),
+        'paths': paths,
+        'tokens': tokens,
+        'lines': lines
     }
 
-def main():
-    baseline = load_baseline()
-    if not baseline:
-        return
-
-    current = measure_current()
-    prompts = measure_prompt_files()
+def count_in_parallel(*path_groups):
+    """Count tokens for each group of paths in its own process."""
+    # fork skips re-importing tiktoken in every worker; only Linux forks safely
+    context = multiprocessing.get_context('fork' if sys.platform == 'linux' else None)
+    with ProcessPoolExecutor(max_workers=len(path_groups), mp_context=context) as executor:
+        futures = [executor.submit(_measure_lib.count_tokens_worker, paths) for paths in path_groups]
+        results = [future.result() for future in futures]
+
+    # Merge in the parent and write the cache once, so workers can't race
+    counts = {}
+    for group_counts, cache_entries in results:
+        counts.update(group_counts)
+        _measure_lib.merge_cache(cache_entries)
+    _measure_lib.save_cache()
+    return counts
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Compare context window usage against the baseline.')
+    parser.add_argument('--lines-only', action='store_true',
+                        help='compare line counts only, skipping tokenization')
+    parser.add_argument('--profile', action='store_true',
+                        help=f'write cProfile stats to {_measure_lib.PROFILE_PATH}')
+    return parser.parse_args()
+
+def print_comparison(baseline, current, prompts, lines_only=False):
+    """Print the baseline vs. current comparison report."""
+    metric = 'lines' if lines_only else 'tokens'
 
     print('=' * 80)
     print('CONTEXT WINDOW USAGE COMPARISON')
@@ -102,19 +100,65 @@ def main():
     print('=' * 80)
     print()
 
-    print('COMMAND SIZE CHANGES')
+    # Total the same large commands measure-context does, so both TOTALs agree
+    baseline_commands = baseline['commands']
+    large = [name for name in _measure_lib.LARGE_COMMANDS
+             if name in baseline_commands or name in current]
+    other = [name for name in baseline_commands if name not in _measure_lib.LARGE_COMMANDS]
+    new_commands = [name for name in current
+                    if name not in baseline_commands and name not in _measure_lib.LARGE_COMMANDS]
+
+    print('COMMAND SIZE CHANGES' + (' (lines)' if lines_only else ''))
+    total_baseline, total_current = print_command_rows(large, baseline_commands, current, metric)
+    total_change = total_current - total_baseline
+    total_pct = (total_change / total_baseline * 100) if total_baseline > 0 else 0
+    print(f'{"TOTAL":<25} {total_baseline:>12,} {total_current:>12,} {total_change:>+12,} {total_pct:>+11.1f}%')
+    print()
+
+    if other:
+        print('OTHER COMMANDS (not in TOTAL)')
+        print_command_rows(other, baseline_commands, current, metric)
+        print()
+
+    if new_commands:
+        print('NEW COMMANDS (not in baseline, not in TOTAL)')
+        print('-' * 80)
+        print(f'{"Command":<25} {"Current":>12}')
+        print('-' * 80)
+        print('\n'.join(
+            NEW_ROW_FMT.format(name=name, curr=current[name][metric]) for name in new_commands
+        ))
+        print()
+
+    if prompts['paths']:
+        print('EXTRACTED PROMPT FILES (load into sub-agent context)')
+        print('-' * 80)
+        row_fmt = PROMPT_LINES_ROW_FMT if lines_only else PROMPT_ROW_FMT
+        for path, tokens, lines in zip(prompts['paths'], prompts['tokens'], prompts['lines']):
+            print(row_fmt.format(path=path, lines=lines, tokens=tokens))
+        print('-' * 80)
+        if lines_only:
+            print(f'  {"TOTAL":<50} {prompts["total_lines"]:>6} lines')
+        else:
+            print(f'  {"TOTAL":<50} {prompts["total_lines"]:>6} lines  {prompts["total_tokens"]:>8,} tokens')
+        print()
+
+    if not lines_only:
+        print_execute_savings(baseline, current)
+
+    print('=' * 80)
+
+def print_command_rows(names, baseline_commands, current, metric):
+    """Print baseline vs. current rows for the named commands, returning their totals."""
     print('-' * 80)
     print(f'{"Command":<25} {"Baseline":>12} {"Current":>12} {"Change":>12} {"% Change":>12}')
     print('-' * 80)
 
-    total_baseline = 0
-    total_current = 0
-
-    for name, curr in current.items():
-        base = baseline['commands'].get(name, {})
-        base_tokens = base.get('tokens', 0)
-        curr_tokens = curr['tokens']
-
+    total_baseline = total_current = 0
+    formatted = []
+    for name in names:
+        base_tokens = baseline_commands.get(name, {}).get(metric, 0)
+        curr_tokens = current.get(name, {}).get(metric, 0)
         total_baseline += base_tokens
         total_current += curr_tokens
 
@@ -123,26 +167,17 @@ def main():
 
         indicator = '✓' if change < 0 else ('•' if change == 0 else '✗')
 
-        print(f'{name:<25} {base_tokens:>12,} {curr_tokens:>12,} {change:>+12,} {pct_change:>+11.1f}% {indicator}')
+        formatted.append(ROW_FMT.format(name=name, base=base_tokens, curr=curr_tokens,
+                                        change=change, pct=pct_change, ind=indicator))
 
+    print('\n'.join(formatted))
     print('-' * 80)
-    total_change = total_current - total_baseline
-    total_pct = (total_change / total_baseline * 100) if total_baseline > 0 else 0
-    print(f'{"TOTAL":<25} {total_baseline:>12,} {total_current:>12,} {total_change:>+12,} {total_pct:>+11.1f}%')
-    print()
+    return total_baseline, total_current
 
-    if prompts['files']:
-        print('EXTRACTED PROMPT FILES (load into sub-agent context)')
-        print('-' * 80)
-        for f in prompts['files']:
-            print(f'  {f["path"]:<50} {f["lines"]:>6} lines  {f["tokens"]:>8,} tokens')
-        print('-' * 80)
-        print(f'  {"TOTAL":<50} {prompts["total_lines"]:>6} lines  {prompts["total_tokens"]:>8,} tokens')
-        print()
-
-    # Calculate effective savings for execute invocation
-    exec_baseline = baseline['commands']['execute.md']['tokens']
-    exec_current = current['execute.md']['tokens']
+def print_execute_savings(baseline, current):
+    """Print the effective context savings for a /tiki:execute invocation."""
+    exec_baseline = baseline['commands'].get('execute.md', {}).get('tokens', 0)
+    exec_current = current.get('execute.md', {}).get('tokens', 0)
 
     print('EFFECTIVE SAVINGS FOR /tiki:execute')
     print('-' * 80)
@@ -170,9 +205,43 @@ def main():
         print('• No change yet (refactoring not started or not complete)')
     else:
         print('✗ Context usage increased (unexpected)')
-
     print()
-    print('=' * 80)
+
+def main():
+    args = parse_args()
+    if args.profile:
+        _measure_lib.profile(lambda: run(args))
+    else:
+        run(args)
+
+def run(args):
+    baseline = load_baseline()
+    if not baseline:
+        return
+
+    # Commands and prompt files are disjoint, so tokenize them side by side
+    command_paths = [path for _, path in _measure_lib.gather_commands()]
+    prompt_paths = gather_prompt_files()
+    if args.lines_only:
+        counts = count_lines_only(command_paths + prompt_paths)
+    elif args.profile:
+        # Count in this process so the profile shows the real work rather
+        # than socket and future waits
+        counts = count_tokens(command_paths + prompt_paths, use_server=False)
+    else:
+        # A warm server already has the encoder loaded; only fan out without one
+        counts = _measure_lib.query_server(command_paths + prompt_paths)
+        if counts is None:
+            counts = count_in_parallel(command_paths, prompt_paths)
+
+    current = measure_current(counts)
+    prompts = measure_prompt_files(counts)
+
+    # Build the report in a buffer so it goes out in one write
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        print_comparison(baseline, current, prompts, lines_only=args.lines_only)
+    sys.stdout.write(out.getvalue())
 
 if __name__ == '__main__':
     main()
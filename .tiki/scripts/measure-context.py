@@ -7,52 +7,49 @@ Run this before and after refactoring to measure improvement.
 Usage:
     python .tiki/scripts/measure-context.py
     python .tiki/scripts/measure-context.py --json  # Output as JSON for comparison
+    python .tiki/scripts/measure-context.py --server  # Keep the encoder warm for later runs
+    python .tiki/scripts/measure-context.py --lines-only  # Quick line counts, no tokenizing
+    python .tiki/scripts/measure-context.py --profile  # Write cProfile stats to .tiki/.measure.prof
+
+View a profile with: snakeviz .tiki/.measure.prof
+
+Runs start a --server in the background automatically where Unix domain
+sockets are available; it exits after 10 minutes without requests.
 """
 
-import tiktoken
-import os
+import argparse
+import contextlib
+import io
 import json
 import sys
 from datetime import datetime
 
-enc = tiktoken.get_encoding('cl100k_base')
-
-def count_tokens(filepath):
-    """Count tokens and lines in a file."""
-    try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            content = f.read()
-        return len(enc.encode(content)), len(content.split('\n'))
-    except:
-        return 0, 0
-
-def measure_commands():
-    """Measure all large commands."""
-    commands = [
-        ('execute.md', '.claude/commands/tiki/execute.md'),
-        ('plan-issue.md', '.claude/commands/tiki/plan-issue.md'),
-        ('define-requirements.md', '.claude/commands/tiki/define-requirements.md'),
-        ('research.md', '.claude/commands/tiki/research.md'),
-        ('debug.md', '.claude/commands/tiki/debug.md'),
-        ('release-yolo.md', '.claude/commands/tiki/release-yolo.md'),
-    ]
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+import _measure_lib
+from _measure_lib import count_lines_only, count_tokens, gather_files, measure_prompt_files
 
+# Per-row report templates, selected once per table rather than per row
+COMMAND_ROW_FMT = '{name:<30} {lines:>10,} {tokens:>12,} {pct_of_200k:>11.1f}%'
+COMMAND_LINES_ROW_FMT = '{name:<30} {lines:>10,}'
+PROMPT_ROW_FMT = '  {filename:<35} {lines:>6} lines  {tokens:>8,} tokens'
+PROMPT_LINES_ROW_FMT = '  {filename:<35} {lines:>6} lines'
+
+def measure_commands(counts):
+    """Measure all Tiki commands."""
     results = {}
-    for name, path in commands:
-        tokens, lines = count_tokens(path)
-        results[name] = {
-            'path': path,
-            'tokens': tokens,
-            'lines': lines,
-            'pct_of_200k': round(tokens / 200000 * 100, 2)
-        }
+    for name, info in _measure_lib.measure_commands(counts).items():
+        results[name] = dict(info, pct_of_200k=round(info['tokens'] / 200000 * 100, 2))
 
     return results
 
-def measure_execute_invocation():
+def measure_execute_invocation(commands, counts):
     """Simulate a typical /tiki:execute invocation."""
-    exec_tokens, _ = count_tokens('.claude/commands/tiki/execute.md')
-    claude_tokens, _ = count_tokens('CLAUDE.md')
+    exec_tokens = commands.get('execute.md', {}).get('tokens', 0)
+    claude_tokens, _ = counts['CLAUDE.md']
 
     # Estimates for things we can't directly measure
     components = {
@@ -72,77 +69,85 @@ def measure_execute_invocation():
         'pct_used': round(total / 200000 * 100, 2)
     }
 
-def measure_prompt_files():
-    """Measure extracted prompt files (after refactoring)."""
-    prompt_dirs = [
-        '.tiki/prompts/execute',
-        '.tiki/prompts/plan',
-        '.tiki/prompts/requirements',
-        '.tiki/prompts/research',
-        '.tiki/prompts/debug',
-        '.tiki/prompts/release',
-    ]
+def parse_args():
+    parser = argparse.ArgumentParser(description='Measure context window usage for Tiki commands.')
+    parser.add_argument('--json', action='store_true',
+                        help='output as JSON for comparison')
+    parser.add_argument('--server', action='store_true',
+                        help=f'serve token counts on {_measure_lib.SOCKET_PATH} until idle')
+    parser.add_argument('--lines-only', action='store_true',
+                        help='only count lines, skipping tokenization')
+    parser.add_argument('--profile', action='store_true',
+                        help=f'write cProfile stats to {_measure_lib.PROFILE_PATH}')
+    args = parser.parse_args()
+    if args.lines_only and args.json:
+        parser.error('--lines-only cannot be saved as a --json baseline')
+    return args
+
+def print_report(data, lines_only=False):
+    """Print the human-readable context usage report."""
+    timestamp = data['timestamp']
 
-    results = {}
-    for dir_path in prompt_dirs:
-        if os.path.exists(dir_path):
-            dir_results = {}
-            for filename in os.listdir(dir_path):
-                if filename.endswith('.md'):
-                    filepath = os.path.join(dir_path, filename)
-                    tokens, lines = count_tokens(filepath)
-                    dir_results[filename] = {
-                        'tokens': tokens,
-                        'lines': lines
-                    }
-            if dir_results:
-                results[dir_path] = dir_results
+    print('=' * 70)
+    print(f'TIKI COMMAND CONTEXT USAGE - {timestamp[:10]}' + (' (lines only)' if lines_only else ''))
+    print('=' * 70)
+    print()
 
-    return results
+    large = [name for name in _measure_lib.LARGE_COMMANDS if name in data['commands']]
+    other = [name for name in data['commands'] if name not in _measure_lib.LARGE_COMMANDS]
+    row_fmt = COMMAND_LINES_ROW_FMT if lines_only else COMMAND_ROW_FMT
 
-def main():
-    output_json = '--json' in sys.argv
+    print('LARGE COMMANDS')
+    print_command_header(lines_only)
+    for name in large:
+        print(row_fmt.format(name=name, **data['commands'][name]))
 
-    timestamp = datetime.now().isoformat()
+    print('-' * 70)
+    if lines_only:
+        print(f'{"TOTAL":<30} {data["totals"]["all_large_commands_lines"]:>10,}')
+    else:
+        print(f'{"TOTAL":<30} {data["totals"]["all_large_commands_lines"]:>10,} {data["totals"]["all_large_commands_tokens"]:>12,} {data["totals"]["all_large_commands_tokens"]/200000*100:>11.1f}%')
+    print()
 
-    data = {
-        'timestamp': timestamp,
-        'commands': measure_commands(),
-        'execute_invocation': measure_execute_invocation(),
-        'prompt_files': measure_prompt_files(),
-    }
+    if other:
+        print('OTHER COMMANDS (not in TOTAL)')
+        print_command_header(lines_only)
+        for name in other:
+            print(row_fmt.format(name=name, **data['commands'][name]))
+        print()
 
-    # Calculate totals
-    data['totals'] = {
-        'all_large_commands_tokens': sum(c['tokens'] for c in data['commands'].values()),
-        'all_large_commands_lines': sum(c['lines'] for c in data['commands'].values()),
-    }
+    if not lines_only:
+        print_execute_invocation(data['execute_invocation'])
 
-    if output_json:
-        print(json.dumps(data, indent=2))
-        return
+    if data['prompt_files']:
+        print('EXTRACTED PROMPT FILES (sub-agent context)')
+        print('-' * 70)
+        row_fmt = PROMPT_LINES_ROW_FMT if lines_only else PROMPT_ROW_FMT
+        for dir_path, files in data['prompt_files'].items():
+            print(f'\n{dir_path}/')
+            for filename, info in files.items():
+                print(row_fmt.format(filename=filename, **info))
+    else:
+        print('No extracted prompt files found yet (run after refactoring)')
 
-    # Pretty print
+    print()
     print('=' * 70)
-    print(f'TIKI COMMAND CONTEXT USAGE - {timestamp[:10]}')
+    print('To save baseline: python .tiki/scripts/measure-context.py --json > .tiki/context-baseline.json')
     print('=' * 70)
-    print()
 
-    print('LARGE COMMANDS')
-    print('-' * 70)
-    print(f'{"Command":<30} {"Lines":>10} {"Tokens":>12} {"% of 200K":>12}')
+def print_command_header(lines_only):
+    """Print the column header of a command table."""
     print('-' * 70)
-
-    for name, info in data['commands'].items():
-        print(f'{name:<30} {info["lines"]:>10,} {info["tokens"]:>12,} {info["pct_of_200k"]:>11.1f}%')
-
+    if lines_only:
+        print(f'{"Command":<30} {"Lines":>10}')
+    else:
+        print(f'{"Command":<30} {"Lines":>10} {"Tokens":>12} {"% of 200K":>12}')
     print('-' * 70)
-    print(f'{"TOTAL":<30} {data["totals"]["all_large_commands_lines"]:>10,} {data["totals"]["all_large_commands_tokens"]:>12,} {data["totals"]["all_large_commands_tokens"]/200000*100:>11.1f}%')
-    print()
 
+def print_execute_invocation(inv):
+    """Print the token breakdown of a typical /tiki:execute invocation."""
     print('TYPICAL /tiki:execute INVOCATION')
     print('-' * 70)
-    inv = data['execute_invocation']
     print(f'{"Component":<40} {"Tokens":>12}')
     print('-' * 70)
     for name, tokens in inv['components'].items():
@@ -153,20 +158,62 @@ def main():
     print(f'{"Context used":<40} {inv["pct_used"]:>11.1f}%')
     print()
 
-    if data['prompt_files']:
-        print('EXTRACTED PROMPT FILES (sub-agent context)')
-        print('-' * 70)
-        for dir_path, files in data['prompt_files'].items():
-            print(f'\n{dir_path}/')
-            for filename, info in files.items():
-                print(f'  {filename:<35} {info["lines"]:>6} lines  {info["tokens"]:>8,} tokens')
+def main():
+    args = parse_args()
+    if args.profile:
+        _measure_lib.profile(lambda: run(args))
     else:
-        print('No extracted prompt files found yet (run after refactoring)')
+        run(args)
 
-    print()
-    print('=' * 70)
-    print('To save baseline: python .tiki/scripts/measure-context.py --json > .tiki/context-baseline.json')
-    print('=' * 70)
+def run(args):
+    if args.server:
+        _measure_lib.serve()
+        return
+
+    output_json = args.json
+
+    timestamp = datetime.now().isoformat()
+
+    paths = gather_files(['CLAUDE.md'])
+    if args.lines_only:
+        counts = count_lines_only(paths)
+    else:
+        # A profile should show the real counting work, not a socket wait
+        counts = count_tokens(paths, use_server=not args.profile)
+
+    commands = measure_commands(counts)
+
+    data = {
+        'timestamp': timestamp,
+        'commands': commands,
+        'execute_invocation': measure_execute_invocation(commands, counts),
+        'prompt_files': measure_prompt_files(counts),
+    }
+
+    # Calculate totals over the large commands only
+    large = [commands[name] for name in _measure_lib.LARGE_COMMANDS if name in commands]
+    data['totals'] = {
+        'all_large_commands_tokens': sum(c['tokens'] for c in large),
+        'all_large_commands_lines': sum(c['lines'] for c in large),
+    }
+
+    if output_json:
+        # Both paths emit unescaped UTF-8 through the text layer, so baselines
+        # match byte for byte and get the platform's newline translation.
+        # Force UTF-8 so a redirect on Windows doesn't use the locale codec.
+        sys.stdout.reconfigure(encoding='utf-8')
+        if orjson:
+            option = orjson.OPT_INDENT_2 | orjson.OPT_APPEND_NEWLINE
+            sys.stdout.write(orjson.dumps(data, option=option).decode('utf-8'))
+        else:
+            print(json.dumps(data, indent=2, ensure_ascii=False))
+        return
+
+    # Pretty print into a buffer so the report goes out in one write
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        print_report(data, lines_only=args.lines_only)
+    sys.stdout.write(out.getvalue())
 
 if __name__ == '__main__':
     main()